@@ -1,3 +1,10 @@
-from .geospy import GeoSpy
+__all__ = ["GeoSpy"]
 
-__all__ = ["GeoSpy"]
\ No newline at end of file
+
+def __getattr__(name):
+    # Imported on first use so `geospyer --help` doesn't pay for requests.
+    if name == "GeoSpy":
+        from .geospy import GeoSpy
+
+        return GeoSpy
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
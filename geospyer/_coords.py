@@ -0,0 +1,38 @@
+import re
+
+# "48.8584° N" -> value and optional hemisphere letter in one match.
+_COORD_RE = re.compile(r"\s*([-+]?\d+(?:\.\d+)?)\s*°?\s*([NSEWnsew])?")
+_SIGN = {"N": 1, "S": -1, "E": 1, "W": -1}
+
+
+def to_float(value):
+    match = _COORD_RE.match(value)
+    if match is None:
+        raise ValueError(f"Invalid coordinate: {value!r}")
+    number, direction = match.groups()
+    return float(number) * _SIGN.get(direction.upper(), 1) if direction else float(number)
+
+
+def maps_link(coordinates):
+    latitude, longitude = coordinates
+    if "°" in latitude or "°" in longitude:
+        return f"https://www.google.com/maps?q={to_float(latitude)},{to_float(longitude)}"
+    return f"https://www.google.com/maps?q={latitude},{longitude}"
+
+
+def parse_message(message):
+    # Lines are "Label: value"; split the message once and keep the text
+    # after the last colon of each line. Anything without the country, city,
+    # explanation and "lat, lon" lines is rejected with ValueError.
+    if not isinstance(message, str):
+        raise ValueError(f"Unexpected message from the server: {message!r}")
+    values = [line.rsplit(":", 1)[-1].strip() for line in message.split("\n")]
+    coordinates = values[-1].split(",")
+    if len(values) < 4 or len(coordinates) != 2:
+        raise ValueError(f"Unexpected message from the server: {message!r}")
+    return {
+        "country": values[0],
+        "city": values[1],
+        "explanation": values[2],
+        "coordinates": coordinates,
+    }
@@ -1,126 +1,139 @@
 import argparse
-import http.client
-import mimetypes
-from io import BytesIO
-import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
+from geospyer._coords import maps_link, parse_message
 
-def display_map(cordinates):
-    # Extract latitude and longitude from the coordinates
-    latitude, longitude = cordinates
-    google_maps_link = ""
+# Color codes are decided once: plain text when the output is not a terminal.
+_USE_COLOR = sys.stdout.isatty()
+_GREEN = "\033[92m" if _USE_COLOR else ""
+_BLUE = "\033[94m" if _USE_COLOR else ""
+_RESET = "\033[0m" if _USE_COLOR else ""
+_FOUND_LINE = f"{_GREEN}AI found where the picture was taken{_RESET}\n"
+_FAILED_LINE = "Service has failed to process the request, please try again.\n"
 
-    # if latitude or longitude contains '°' or 'N' or 'S' or 'E' or 'W'
-    if "°" in latitude or "°" in longitude:
-        # Extract numerical values and direction
-        latitude_value, latitude_direction = map(str.strip, latitude.split("°"))
-        longitude_value, longitude_direction = map(str.strip, longitude.split("°"))
+# Shared client so repeated calls reuse the pooled HTTPS connection. It is
+# created on first use to keep startup (and --help) free of network imports.
+_geospy = None
 
-        # Determine the sign for latitude and longitude
-        latitude_sign = 1 if latitude_direction.upper() == "N" else -1
-        longitude_sign = 1 if longitude_direction.upper() == "E" else -1
 
-        # Convert string values to float
-        latitude_float = float(latitude_value) * latitude_sign
-        longitude_float = float(longitude_value) * longitude_sign
+def _client(max_dim=None, cache_dir=None):
+    global _geospy
+    if _geospy is None:
+        from geospyer.geospy import GeoSpy
 
-        # Generate Google Maps link
-        google_maps_link = (
-            f"https://www.google.com/maps?q={latitude_float},{longitude_float}"
-        )
+        _geospy = GeoSpy(max_dim=max_dim, cache_dir=cache_dir)
+    return _geospy
 
-    else:
-        # Extract numerical values and direction
-        google_maps_link = f"https://www.google.com/maps?q={latitude},{longitude}"
 
+def display_map(cordinates):
     # Display the Google Maps link
-    return f"Google Maps Link: {google_maps_link}"
+    return f"Google Maps Link: {maps_link(cordinates)}"
 
-def send_image_to_server(image_path):
-    # Open the image file
-    with open(image_path, "rb") as image_file:
-        image_data = image_file.read()
-
-    # Set up connection to the server using HTTPS
-    connection = http.client.HTTPSConnection("locate-image-7cs5mab6na-uc.a.run.app")
-
-    # Set the headers, including the custom header
-    headers = {
-        "Content-Type": "multipart/form-data; boundary=boundary",
-        "accept": "*/*",
-        "accept-language": "en-US,en;q=0.9,tr;q=0.8,ar;q=0.7",
-        "sec-ch-ua": '"Not_A Brand";v="8", "Chromium";v="120", "Google Chrome";v="120"',
-        "sec-ch-ua-mobile": "?0",
-        "sec-ch-ua-platform": '"Windows"',
-        "sec-fetch-dest": "empty",
-        "sec-fetch-mode": "cors",
-        "sec-fetch-site": "cross-site",
-        "Referer": "https://geospy.web.app/",
-        "Referrer-Policy": "strict-origin-when-cross-origin",
-    }
-
-    # Create a multipart/form-data request
-    body = BytesIO()
-    boundary = b"--boundary"
-
-    # Add image data
-    body.write(boundary + b"\r\n")
-    body.write(
-        b'Content-Disposition: form-data; name="image"; filename="image.jpg"\r\n'
-    )
-    body.write(
-        b"Content-Type: " + mimetypes.guess_type("image.jpg")[0].encode() + b"\r\n\r\n"
-    )
-    body.write(image_data)
-    body.write(b"\r\n")
-
-    # Finalize the request
-    body.write(boundary + b"--\r\n")
-
-    # Send the request
-    connection.request("POST", "/", body=body.getvalue(), headers=headers)
-
-    # Get the response
-    response = connection.getresponse()
-
-    # Print the response status and data
-    response_data = response.read().decode()
-    # Extract the message from the JSON data
-    if response_data and response.status == 200:
-        print(f"\033[92mAI found where the picture was taken\033[92m\n")
-        json_data = json.loads(response_data)
-        message = json_data.get("message")
-        coordinates = message.split("\n")[-1].split(":")[-1].strip().split(",")
-        print(message.strip())
-        print(display_map(coordinates))
-    else:
-        print(f"Status: {response.status} {response.reason}")
-        print(f"Service has failed to process the request, please try again.")
 
-    # Close the connection
-    connection.close()
+def format_result(message):
+    if not message:
+        return _FAILED_LINE
+    coordinates = parse_message(message)["coordinates"]
+    return f"{_FOUND_LINE}\n{message.strip()}\n{display_map(coordinates)}\n"
+
+
+def _fetch_result(geospy, image_path):
+    # Runs on a worker thread: one bad image becomes its own failure block
+    # instead of aborting the whole batch.
+    try:
+        return format_result(geospy.send_image_to_server(image_path))
+    except (OSError, ValueError) as error:
+        return f"Error: {error}\n"
+
+
+def print_result(message):
+    sys.stdout.write(format_result(message))
+
+
+def send_image_to_server(image_path):
+    print_result(_client().send_image_to_server(image_path))
+
+
+def serve(geospy):
+    # One JSON object per line on stdout for every image path read from stdin,
+    # so scripts pay for interpreter startup and the TLS handshake only once.
+    from geospyer.geospy import _json_dumps
+
+    out = sys.stdout.buffer
+    for line in sys.stdin:
+        image_path = line.strip()
+        if not image_path:
+            continue
+        try:
+            result = geospy.locate(image_path)
+        except (OSError, ValueError) as error:
+            # Bad paths, network failures and malformed replies are reported
+            # per line so the remaining paths are still answered.
+            output = {"image": image_path, "error": str(error)}
+        else:
+            if result:
+                output = {"image": image_path, **result}
+            else:
+                output = {"image": image_path, "error": "Service has failed to process the request"}
+        out.write(_json_dumps(output) + b"\n")
+        out.flush()
 
 
 def banner():
-    font = """
-\033[94m▒█▀▀█ █▀▀ █▀▀█ ▒█▀▀▀█ █▀▀█ █░░█ 
+    font = f"""
+{_BLUE}▒█▀▀█ █▀▀ █▀▀█ ▒█▀▀▀█ █▀▀█ █░░█ 
 ▒█░▄▄ █▀▀ █░░█ ░▀▀▀▄▄ █░░█ █▄▄█ 
 ▒█▄▄█ ▀▀▀ ▀▀▀▀ ▒█▄▄▄█ █▀▀▀ ▄▄▄█
 AI powered geo-location. Uncover the location photos were taken from by harnessing the power of AI
 Disclaimer: This application uses Graylark's AI powered geolocation. This application is not affiliated with Graylark and I'm not responsible for the consequences of using this application.
 Github: https://github.com/atiilla/geospy
 """
-    print(font + "\033[0m")
+    print(font + _RESET)
 
 
 def main():
-    banner()
     parser = argparse.ArgumentParser()
-    parser.add_argument("--image", type=str, help="image path")
+    parser.add_argument("--image", type=str, nargs="+", help="image path(s)")
+    parser.add_argument(
+        "--workers", type=int, default=8, help="number of images analyzed in parallel"
+    )
+    parser.add_argument(
+        "--max-dim",
+        type=int,
+        help="downscale images so their longest side is at most this many pixels before upload",
+    )
+    parser.add_argument(
+        "--cache-dir", help="directory where results are cached between runs"
+    )
+    parser.add_argument("--no-banner", action="store_true", help="do not print the banner")
+    parser.add_argument(
+        "--server",
+        action="store_true",
+        help="read image paths from stdin and write one JSON result per line",
+    )
     args = parser.parse_args()
 
+    if args.server:
+        serve(_client(max_dim=args.max_dim, cache_dir=args.cache_dir))
+        return
+
+    if not args.no_banner and sys.stdout.isatty():
+        banner()
+
     if args.image:
-        send_image_to_server(args.image)
+        geospy = _client(max_dim=args.max_dim, cache_dir=args.cache_dir)
+        # Uploads overlap across images; results are still printed in order.
+        with ThreadPoolExecutor(max_workers=max(1, min(args.workers, len(args.image)))) as executor:
+            blocks = executor.map(partial(_fetch_result, geospy), args.image)
+            write = sys.stdout.write
+            show_path = len(args.image) > 1
+            for image_path, block in zip(args.image, blocks):
+                # Emit each image's block with a single write.
+                if show_path:
+                    block = f"\n{image_path}\n{block}"
+                write(block)
 
     else:
         print("Please provide an image path using the --image argument.")
\ No newline at end of file
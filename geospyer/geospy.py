@@ -1,95 +1,407 @@
-import http.client
-import mimetypes
+import asyncio
+import hashlib
+import logging
+import mmap
+import os
+import stat
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 import json
 
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ._coords import maps_link, parse_message
+
+try:
+    import orjson
+except ImportError:  # optional speedup, see the "fast" extra
+    orjson = None
+
+if orjson is not None:
+    _json_loads = orjson.loads
+    _json_dumps = orjson.dumps
+else:
+    _json_loads = json.loads
+
+    def _json_dumps(obj):
+        return json.dumps(obj, ensure_ascii=False).encode()
+
+_log = logging.getLogger(__name__)
+
+HOST = "locate-image-7cs5mab6na-uc.a.run.app"
+URL = f"https://{HOST}/"
+
+_HEADERS = {
+    "Content-Type": "multipart/form-data; boundary=boundary",
+    "accept": "*/*",
+    "accept-language": "en-US,en;q=0.9,tr;q=0.8,ar;q=0.7",
+    "sec-ch-ua": '"Not_A Brand";v="8", "Chromium";v="120", "Google Chrome";v="120"',
+    "sec-ch-ua-mobile": "?0",
+    "sec-ch-ua-platform": '"Windows"',
+    "sec-fetch-dest": "empty",
+    "sec-fetch-mode": "cors",
+    "sec-fetch-site": "cross-site",
+    "Referer": "https://geospy.web.app/",
+    "Referrer-Policy": "strict-origin-when-cross-origin",
+}
+
+
+def _multipart_header(extension, content_type):
+    return (
+        b"--boundary\r\n"
+        b'Content-Disposition: form-data; name="image"; filename="image.' + extension + b'"\r\n'
+        b"Content-Type: " + content_type + b"\r\n\r\n"
+    )
+
+
+# The multipart envelope only depends on the image type, so build one per
+# known (offset, signature) up front; the image bytes are sent between the
+# two halves. Unrecognised files keep being announced as JPEG.
+_MULTIPART_HEADER = _multipart_header(b"jpg", b"image/jpeg")
+_HEIC_HEADER = _multipart_header(b"heic", b"image/heic")
+_MULTIPART_HEADERS = (
+    (0, b"\xff\xd8\xff", _MULTIPART_HEADER),
+    (0, b"\x89PNG\r\n\x1a\n", _multipart_header(b"png", b"image/png")),
+    (0, b"GIF8", _multipart_header(b"gif", b"image/gif")),
+    (8, b"WEBP", _multipart_header(b"webp", b"image/webp")),
+    (4, b"ftypheic", _HEIC_HEADER),
+    (4, b"ftypheix", _HEIC_HEADER),
+    (4, b"ftypmif1", _HEIC_HEADER),
+)
+_MULTIPART_FOOTER = b"\r\n--boundary--\r\n"
+
+# Connection failures, rate limiting and transient server errors are retried
+# with exponential backoff (honouring Retry-After) on the already prepared
+# body, rather than surfacing to the caller. Read timeouts are not retried so
+# a stalled analysis does not multiply the wait. Jitter keeps concurrent
+# workers from retrying in lockstep after a shared 429.
+_MAX_RETRY_AFTER = 10
+
+
+class _Retry(Retry):
+    # A worker sleeping on Retry-After keeps its pooled connection, and with
+    # pool_block every other caller queues behind it, so never honour more
+    # than _MAX_RETRY_AFTER seconds.
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, _MAX_RETRY_AFTER)
+
+
+_RETRY_OPTIONS = dict(
+    total=5,
+    read=False,
+    backoff_factor=0.5,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset(["POST"]),
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+try:
+    _RETRY = _Retry(backoff_jitter=0.25, **_RETRY_OPTIONS)
+except TypeError:  # urllib3 < 2 has no jitter
+    _RETRY = _Retry(**_RETRY_OPTIONS)
+
+
+def _sniff_multipart_header(image_data):
+    head = bytes(image_data[:16])
+    for offset, signature, header in _MULTIPART_HEADERS:
+        if head.startswith(signature, offset):
+            return header
+    return _MULTIPART_HEADER
+
+
+# Images below this size are uploaded as-is even when max_dim is set.
+_DOWNSCALE_MIN_BYTES = 512 * 1024
+
+# Files below this size are cheaper to read outright than to map.
+_MMAP_THRESHOLD = 1024 * 1024
+
+
+def _load_image(image_path, size):
+    # Large files are mapped read-only so hashing and the socket read straight
+    # from the page cache instead of copying the file into Python bytes; the
+    # mapping is released once the last reference to it goes away. Small ones
+    # take a single unbuffered read. `size` comes from the caller's stat.
+    fd = os.open(image_path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    try:
+        if size < _MMAP_THRESHOLD:
+            return os.read(fd, size)
+        return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    finally:
+        os.close(fd)
+
+
+def _is_valid_message(message):
+    # Everything locate() derives from a message, map link included, must
+    # work before the message is worth caching.
+    try:
+        maps_link(parse_message(message)["coordinates"])
+    except ValueError:
+        return False
+    return True
+
+
+class _MultipartBody:
+    """Re-iterable multipart body wrapped around the image buffer.
+
+    Exposing ``__len__`` lets requests send a Content-Length header instead of
+    falling back to chunked transfer encoding.
+    """
+
+    def __init__(self, image_data):
+        self.image_data = image_data
+        self.header = _sniff_multipart_header(image_data)
+
+    def __len__(self):
+        return len(self.header) + len(self.image_data) + len(_MULTIPART_FOOTER)
+
+    def __iter__(self):
+        yield self.header
+        yield memoryview(self.image_data)
+        yield _MULTIPART_FOOTER
+
+
 class GeoSpy:
-    def __init__(self):
-        self.connection = http.client.HTTPSConnection("locate-image-7cs5mab6na-uc.a.run.app")
+    def __init__(self, cache_size=128, timeout=(5, 60), max_dim=None, pool_size=16, cache_dir=None):
+        # A single session keeps TLS connections alive between requests. Up to
+        # pool_size threads can upload at once; further callers wait for a
+        # free connection instead of opening throwaway ones.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            pool_block=True,
+            max_retries=_RETRY,
+        )
+        self.session.mount("https://", adapter)
+        self.timeout = timeout
+        # When set, images whose longest side exceeds max_dim pixels are
+        # re-encoded smaller before upload (requires Pillow).
+        if max_dim:
+            try:
+                import PIL  # noqa: F401
+            except ImportError:
+                raise ImportError("max_dim requires Pillow: pip install 'geospyer[resize]'")
+        self.max_dim = max_dim
+        # Server messages keyed by a digest of the image bytes, oldest first.
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        # (path, mtime, size) -> content digest, bounded like the cache.
+        self._digests = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # Optional persistent copy of the cache, one text file per image, so
+        # answers survive across runs (e.g. repeated CLI invocations).
+        self.cache_dir = cache_dir
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     def send_image_to_server(self, image_path):
-        with open(image_path, "rb") as image_file:
-            image_data = image_file.read()
-
-        headers = {
-            "Content-Type": "multipart/form-data; boundary=boundary",
-            "accept": "*/*",
-            "accept-language": "en-US,en;q=0.9,tr;q=0.8,ar;q=0.7",
-            "sec-ch-ua": '"Not_A Brand";v="8", "Chromium";v="120", "Google Chrome";v="120"',
-            "sec-ch-ua-mobile": "?0",
-            "sec-ch-ua-platform": '"Windows"',
-            "sec-fetch-dest": "empty",
-            "sec-fetch-mode": "cors",
-            "sec-fetch-site": "cross-site",
-            "Referer": "https://geospy.web.app/",
-            "Referrer-Policy": "strict-origin-when-cross-origin",
-        }
-
-        body = BytesIO()
-        boundary = b"--boundary"
-        body.write(boundary + b"\r\n")
-        body.write(b'Content-Disposition: form-data; name="image"; filename="image.jpg"\r\n')
-        body.write(b"Content-Type: " + mimetypes.guess_type("image.jpg")[0].encode() + b"\r\n\r\n")
-        body.write(image_data)
-        body.write(b"\r\n")
-        body.write(boundary + b"--\r\n")
-
-        self.connection.request("POST", "/", body=body.getvalue(), headers=headers)
-        response = self.connection.getresponse()
-        response_data = response.read().decode()
-
-        if response_data and response.status == 200:
-            json_data = json.loads(response_data)
-            message = json_data.get("message")
+        # One stat answers "is it a file", "how big" and "has it changed since
+        # we last hashed it"; an unchanged file is served from the cache
+        # without being read again.
+        stat_result = os.stat(image_path)
+        if not stat.S_ISREG(stat_result.st_mode):
+            raise OSError(f"Not a regular file: {image_path!r}")
+        file_key = (os.path.abspath(image_path), stat_result.st_mtime_ns, stat_result.st_size)
+        with self._cache_lock:
+            key = self._digests.get(file_key)
+        if key is not None:
+            message = self._cache_get(key)
+            if message is not None:
+                return message
+
+        image_data = _load_image(image_path, stat_result.st_size)
+        key = hashlib.blake2b(image_data, digest_size=16).digest()
+        if self.cache_size:
+            with self._cache_lock:
+                self._digests[file_key] = key
+                if len(self._digests) > self.cache_size:
+                    self._digests.popitem(last=False)
+
+        message = self._cache_get(key)
+        if message is not None:
+            return message
+
+        if self.max_dim:
+            image_data = self._downscale(image_data)
+        message = self._post_image(image_data)
+        if message and _is_valid_message(message):
+            # Only replies that parse are kept, so a one-off malformed answer
+            # is retried next time instead of being served forever.
+            self._cache_put(key, message)
+        return message
+
+    def _cache_path(self, key):
+        # Downscaled uploads can get a different answer, so keep them apart.
+        name = key.hex() if not self.max_dim else f"{key.hex()}-{self.max_dim}"
+        return os.path.join(self.cache_dir, name + ".txt")
+
+    def _cache_get(self, key):
+        with self._cache_lock:
+            message = self._cache.get(key)
+            if message is not None:
+                self._cache.move_to_end(key)
+                return message
+
+        if self.cache_dir:
+            try:
+                with open(self._cache_path(key), encoding="utf-8") as cache_file:
+                    message = cache_file.read()
+            except FileNotFoundError:
+                return None
+            if not _is_valid_message(message):
+                return None
+            self._remember(key, message)
             return message
+        return None
+
+    def _cache_put(self, key, message):
+        self._remember(key, message)
+        if self.cache_dir:
+            # Write then rename so readers never see a half-written entry.
+            path = self._cache_path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as cache_file:
+                    cache_file.write(message)
+                os.replace(tmp_path, path)
+            except OSError as error:
+                # The answer is already in hand; a full or read-only cache
+                # directory must not turn it into a failure.
+                _log.warning("Could not write cache entry %s: %s", path, error)
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    def _remember(self, key, message):
+        if self.cache_size:
+            with self._cache_lock:
+                self._cache[key] = message
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+    def _downscale(self, image_data):
+        from PIL import Image, ImageOps
+
+        if len(image_data) < _DOWNSCALE_MIN_BYTES:
+            # Already small on the wire; decoding and re-encoding costs more.
+            return image_data
+        # Pillow decodes lazily, so errors can surface from any step below; in
+        # every case the server gets the original bytes, as it did before.
+        try:
+            with Image.open(BytesIO(image_data)) as image:
+                if max(image.size) <= self.max_dim:
+                    return image_data
+                # Let libjpeg decode at 1/2, 1/4 or 1/8 scale when that still
+                # leaves enough pixels; no-op for other formats.
+                image.draft("RGB", (self.max_dim, self.max_dim))
+                image = ImageOps.exif_transpose(image)
+                image.thumbnail((self.max_dim, self.max_dim), Image.LANCZOS)
+                if image.mode != "RGB":
+                    image = image.convert("RGB")
+                buffer = BytesIO()
+                image.save(buffer, "JPEG", quality=85, optimize=True)
+                return buffer.getvalue()
+        except (OSError, ValueError, Image.DecompressionBombError):
+            return image_data
+
+    def _post_image(self, image_data):
+        response = self.session.post(
+            URL, data=_MultipartBody(image_data), headers=_HEADERS, timeout=self.timeout
+        )
+
+        if response.content and response.status_code == 200:
+            json_data = _json_loads(response.content)
+            if not isinstance(json_data, dict):
+                raise ValueError(
+                    f"Unexpected response from the server: {type(json_data).__name__}"
+                )
+            return json_data.get("message")
         else:
-            print(f"Status: {response.status} {response.reason}")
-            print(f"Service has failed to process the request, please try again.")
+            _log.warning(
+                "Service has failed to process the request: %s %s",
+                response.status_code,
+                response.reason,
+            )
             return None
 
     def country(self, image_path):
         message = self.send_image_to_server(image_path)
         if message:
-            return message.split("\n")[0].split(":")[-1].strip()
+            return parse_message(message)["country"]
 
     def city(self, image_path):
         message = self.send_image_to_server(image_path)
         if message:
-            return message.split("\n")[1].split(":")[-1].strip()
+            return parse_message(message)["city"]
 
     def explanation(self, image_path):
         message = self.send_image_to_server(image_path)
         if message:
-            return message.split("\n")[2].split(":")[-1].strip()
+            return parse_message(message)["explanation"]
 
     def coordinates(self, image_path):
         message = self.send_image_to_server(image_path)
         if message:
-            return message.split("\n")[-1].split(":")[-1].strip().split(",")
+            return parse_message(message)["coordinates"]
 
     def maps(self, image_path):
         coordinates = self.coordinates(image_path)
         if coordinates:
-            latitude, longitude = coordinates
-            if "°" in latitude or "°" in longitude:
-                latitude_value, latitude_direction = map(str.strip, latitude.split("°"))
-                longitude_value, longitude_direction = map(str.strip, longitude.split("°"))
-                latitude_sign = 1 if latitude_direction.upper() == "N" else -1
-                longitude_sign = 1 if longitude_direction.upper() == "E" else -1
-                latitude_float = float(latitude_value) * latitude_sign
-                longitude_float = float(longitude_value) * longitude_sign
-                return f"https://www.google.com/maps?q={latitude_float},{longitude_float}"
-            else:
-                return f"https://www.google.com/maps?q={latitude},{longitude}"
+            return maps_link(coordinates)
 
     def locate(self, image_path):
+        # One upload per call; every field is derived from the same response.
         message = self.send_image_to_server(image_path)
         if message:
-            result = {
-                "country": self.country(image_path),
-                "city": self.city(image_path),
-                "explanation": self.explanation(image_path),
-                "coordinates": self.coordinates(image_path),
-                "maps": self.maps(image_path),
-            }
-            return result
\ No newline at end of file
+            result = parse_message(message)
+            result["maps"] = maps_link(result["coordinates"])
+            return result
+
+    def locate_many(self, image_paths, max_workers=8):
+        # Uploads are network bound, so overlap them on threads sharing the
+        # pooled session; results come back in the order of image_paths.
+        image_paths = list(image_paths)
+        if not image_paths:
+            return []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(image_paths))) as executor:
+            return list(executor.map(self.locate, image_paths))
+
+    async def alocate(self, image_path):
+        # requests is blocking, so run the lookup on the loop's executor.
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.locate, image_path)
+
+    async def alocate_many(self, image_paths, concurrency=8):
+        # At most `concurrency` uploads are in flight; results keep input order.
+        # The loop's default executor is capped at min(32, cpu + 4) threads, so
+        # run the batch on a pool sized to `concurrency` instead.
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        image_paths = list(image_paths)
+        if not image_paths:
+            return []
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=min(concurrency, len(image_paths)))
+        try:
+            return await asyncio.gather(
+                *(loop.run_in_executor(executor, self.locate, image_path) for image_path in image_paths)
+            )
+        finally:
+            executor.shutdown(wait=False)
@@ -7,6 +7,10 @@ setup(
     install_requires=[
         'requests',
     ],
+    extras_require={
+        'fast': ['orjson'],
+        'resize': ['Pillow'],
+    },
     entry_points={
     'console_scripts': [
         'geospyer=geospyer.cli:main',